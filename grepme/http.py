@@ -23,6 +23,11 @@ _cache_dir = os.environ.get(
 CACHE_DIR = os.path.join(_cache_dir, "grepme")
 CACHE = Cache(CACHE_DIR)
 
+# where each group's history was split on previous runs, see lib.get_pages.
+# kept apart from CACHE so that --clear-cache doesn't throw them away
+CHECKPOINT_DIR = os.path.join(_cache_dir, "grepme-checkpoints")
+CHECKPOINTS = Cache(CHECKPOINT_DIR)
+
 
 def get(url, allow_cache=True, **fields):
     # remove None entries
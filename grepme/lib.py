@@ -10,16 +10,21 @@ from __future__ import print_function
 
 import re
 import json
+from collections import deque
+from heapq import heapify, heappop, heappush
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 try:
     from configparse import ConfigParser as ArgumentParser
 except ImportError as e:
     print("warning: failed to import configparse, not reading config files")
     from argparse import ArgumentParser
+from argparse import ArgumentTypeError
 from datetime import datetime
 from sys import stdin
 
-from .http import get
+from .http import CHECKPOINTS, get
 from .constants import VERSION
 
 # ANSI terminal color codes
@@ -31,6 +36,13 @@ RESET = "\x1b[0m"
 
 EMPTY_MATCH = re.match("^", "")
 
+# while walking a group, remember where every n'th page ended
+# so later runs can fetch the group in parallel
+CHECKPOINT_INTERVAL = 50
+
+# how often to check for KeyboardInterrupt while waiting on other threads
+POLL_INTERVAL = 0.1
+
 
 def get_logged_in_user():
     "return the user id of the user whose credentials we're using"
@@ -90,47 +102,158 @@ def get_dm(user_id, before_id=None, limit=100):
     return []
 
 
+def _walk_segment(get_function, group, start, stop, checkpoints):
+    """Generator. Yield pages of messages, newest first,
+    from just before the message with id `start` up to and including `stop`.
+    start: str: id to start before, or None for the newest message
+    stop: str: oldest id to include, or None to go until the first message
+    checkpoints: set: message ids, added to every CHECKPOINT_INTERVAL pages
+    """
+    pages = 0
+    mark = None
+    buffer = get_function(group, before_id=start)
+    while buffer:
+        if stop is not None and int(buffer[-1]["id"]) <= int(stop):
+            # ids are increasing, so anything older belongs to the next segment
+            yield [message for message in buffer if int(message["id"]) >= int(stop)]
+            return
+        yield buffer
+        pages += 1
+        last = buffer[-1]["id"]
+        if pages % CHECKPOINT_INTERVAL == 0:
+            # only keep a mark once another full interval has been walked past it,
+            # so no segment ends up shorter than CHECKPOINT_INTERVAL pages
+            if mark is not None:
+                checkpoints.add(mark)
+            mark = last
+        buffer = get_function(group, before_id=last)
+
+
+def _get_segment(get_function, group, start, stop):
+    """fetch a whole segment at once. returns (pages, checkpoints, error).
+    runs in a worker thread, so any exception (even SystemExit) is returned
+    instead of raised: otherwise the pool never records a result
+    and the main thread waits forever."""
+    checkpoints = set()
+    try:
+        pages = list(_walk_segment(get_function, group, start, stop, checkpoints))
+    except BaseException as error:
+        return None, None, error
+    return pages, checkpoints, None
+
+
+def _wait(result):
+    "wait for an AsyncResult without ignoring KeyboardInterrupt"
+    while not result.ready():
+        result.wait(POLL_INTERVAL)
+    return result.get()
+
+
+def _add_checkpoints(key, checkpoints, new_checkpoints):
+    "add to a group's checkpoints, only writing them out if something changed"
+    if not new_checkpoints.issubset(checkpoints):
+        checkpoints.update(new_checkpoints)
+        CHECKPOINTS.set(key, checkpoints)
+
+
+def get_pages(group, dm=False, jobs=1):
+    """Generator. Yield every page of messages in a group, newest first.
+    group: str: id of the group (or user, for direct messages)
+    dm: bool: whether the group is a direct message or not
+    jobs: int: how many segments to fetch at once
+
+    Fetching a group is normally serial, since each page needs the id
+    of the last message on the page before it. To get around that,
+    we remember the id at the end of every CHECKPOINT_INTERVAL pages
+    and split the history at the checkpoints left by previous runs.
+    The newest segment is always fetched one page at a time, so callers that stop
+    early never fetch more than they need. Once it has been used up,
+    up to `jobs` of the remaining segments are fetched in parallel and yielded in
+    order, so up to (jobs + 1) * CHECKPOINT_INTERVAL pages can be in memory at once.
+    With `jobs` <= 1, every segment is fetched one page at a time instead.
+    Either way, only segments longer than CHECKPOINT_INTERVAL pages
+    (in practice the newest one) add new checkpoints.
+    """
+    get_function = get_dm if dm else get_messages
+    key = (dm, group)
+    checkpoints = CHECKPOINTS.get(key) or set()
+    bounds = sorted(checkpoints, key=int, reverse=True)
+    segments = iter(zip([None] + bounds, bounds + [None]))
+
+    for start, stop in islice(segments, 1 if jobs > 1 else None):
+        new_checkpoints = set()
+        try:
+            for page in _walk_segment(
+                get_function, group, start, stop, new_checkpoints
+            ):
+                yield page
+        finally:
+            _add_checkpoints(key, checkpoints, new_checkpoints)
+    if jobs <= 1 or not bounds:
+        return
+
+    pool = ThreadPool(jobs)
+    try:
+        pending = deque(
+            pool.apply_async(_get_segment, (get_function, group, start, stop))
+            for start, stop in islice(segments, jobs)
+        )
+        while pending:
+            pages, new_checkpoints, error = _wait(pending.popleft())
+            if error is not None:
+                raise error
+            for start, stop in islice(segments, 1):
+                pending.append(
+                    pool.apply_async(_get_segment, (get_function, group, start, stop))
+                )
+            _add_checkpoints(key, checkpoints, new_checkpoints)
+            for page in pages:
+                yield page
+    finally:
+        pool.terminate()
+
+
 def search_messages(group, config, dm=False):
-    """Generator. Find all messages which are matched by `filter_message`
-    filter_message: a function taking a dictionary and returning a boolean
+    """Generator. Find all messages which are matched by `filter_page`
     group: _sre.SRE_Pattern: regex created using `re.compile`
     config: an object with the boolean properties
             'reverse_matching', 'only_matching', and 'color'
+            and optionally the integer property 'jobs'
     dm: bool: whether the group is a direct message or not
 
-    Note below that the while loop comes right before a for loop.
+    Note that the while loop in `_walk_segment` feeds the for loops below.
     Note also the yield instead of a return.
     This is a common pattern for grepme: GroupMe returns an arbitrarily large amount
     of data (sometimes gigabytes!) and it would far too expensive to process it
     all at once. Instead, we process a fixed amount at a time (usually 100 messages)
     and yield it one message at a time so it's evaluated lazily.
     """
-    get_function = get_dm if dm else get_messages
-    last = None
-    buffer = get_function(group)
-    while buffer:
-        for i, message in enumerate(buffer):
-            result = filter_message(message, config)
-            if result is None:
-                continue
-            if not config.reverse_matching:
-                if config.only_matching:
-                    message["text"] = result.group()
-                    start, end = 0, len(result.group())
-                else:
-                    start, end = result.span()
-                if config.color:
-                    message["text"] = (
-                        message["text"][:start]
-                        + RED
-                        + message["text"][start:end]
-                        + RESET
-                        + message["text"][end:]
-                    )
-            # TODO: this may not show all context if the text comes right at the end of a page
-            yield buffer, i
-        last = buffer[-1]["id"]
-        buffer = get_function(group, before_id=last)
+    for buffer in get_pages(group, dm=dm, jobs=getattr(config, "jobs", 1)):
+        for match in _search_page(buffer, config):
+            yield match
+
+
+def _search_page(buffer, config):
+    """Generator. Yield (buffer, i) for every match in a single page,
+    highlighting the matched text as requested by `config`."""
+    for i, result in filter_page(buffer, config):
+        message = buffer[i]
+        if not config.reverse_matching:
+            if config.only_matching:
+                message["text"] = result.group()
+                start, end = 0, len(result.group())
+            else:
+                start, end = result.span()
+            if config.color:
+                message["text"] = (
+                    message["text"][:start]
+                    + RED
+                    + message["text"][start:end]
+                    + RESET
+                    + message["text"][end:]
+                )
+        # TODO: this may not show all context if the text comes right at the end of a page
+        yield buffer, i
 
 
 def get_all_groups(dm=False):
@@ -231,6 +354,14 @@ def print_group(group, color=True):
         print("--- %s ---" % group)
 
 
+def non_negative_int(value):
+    "argparse type for counts, which can't be negative"
+    number = int(value)
+    if number < 0:
+        raise ArgumentTypeError("%s must not be negative" % value)
+    return number
+
+
 def make_parser():
     "create a parser grepme. makes the main method easier to read"
     parser = ArgumentParser(
@@ -304,6 +435,25 @@ def make_parser():
         action="store_true",
         help="only show messages that didn't match",
     )
+    parser.add_argument(
+        "-m",
+        "--max-count",
+        type=non_negative_int,
+        help="stop after n matching messages, across all groups",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="show matches from all groups together, newest first",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=non_negative_int,
+        default=4,
+        help="fetch up to n parts of a group's history at once. "
+        "ignored with --merge",
+    )
     parser.add_argument(
         "-V",
         "--version",
@@ -410,12 +560,119 @@ def filter_message(message, config):
     return result if result is not None else EMPTY_MATCH
 
 
+def filter_page(buffer, config):
+    """Filter a whole page of messages at once.
+    buffer: list[object]: messages to filter, e.g. one page from `get_messages`
+    config: the same object accepted by `filter_message`
+
+    Returns a list of (index, match) pairs for every message in `buffer`
+    that `filter_message` would accept, in the same order.
+    All lookups on `config` are done once per page instead of once per message.
+
+    Note that this does not join the page into one string and run a single
+    `finditer`: patterns compiled with DOTALL (or with anchors or lookarounds)
+    could then match across message boundaries and change the results."""
+    search = config.regex.search
+    users = config.users.search if config.users.pattern else None
+    favorited = config.favorited
+    not_favorited = config.not_favorited
+    reverse_matching = config.reverse_matching
+
+    matches = []
+    for i, message in enumerate(buffer):
+        text = message["text"]
+        if (
+            text is None
+            or users is not None
+            and not users(message["name"])
+            or favorited
+            and favorited.isdisjoint(message["favorited_by"])
+            or not_favorited
+            and not_favorited.intersection(message["favorited_by"])
+        ):
+            continue
+        result = search(text)
+        if (result is None) != reverse_matching:
+            continue
+        matches.append((i, result if result is not None else EMPTY_MATCH))
+    return matches
+
+
+def get_all_matching_groups(args):
+    """Generator. Yield (name, id, dm) for every group and direct message
+    matching `args.groups`."""
+    for dm in [True, False]:
+        for name, group in get_group(args.groups, dm=dm):
+            yield name, group, dm
+
+
+def merge_searches(streams, config):
+    """Generator. Merge the matches from several groups into one newest-first stream.
+    streams: iterable of (group, pages), where `pages` yields pages newest-first
+             like `get_pages` and `group` is any value identifying the group
+    config: the same object accepted by `search_messages`
+    Yields (group, buffer, i), where (buffer, i) is as for `search_messages`.
+
+    This is a k-way merge keyed on each group's frontier: its next pending match
+    if it has one, otherwise the oldest message fetched so far,
+    since everything not yet fetched is older than that.
+    A group's next page is only fetched once its frontier is the newest in the heap.
+    So at most about one page per group is kept in memory,
+    groups without recent matches aren't downloaded in full,
+    and nothing more is fetched once the caller stops iterating."""
+    # negate keys since heapq is a min-heap and we want newest-first.
+    # `n` is unique, so ties never fall through to comparing the rest of the entry.
+    # groups that haven't fetched anything yet go first.
+    heap = [
+        (-float("inf"), n, group, iter(pages), deque())
+        for n, (group, pages) in enumerate(streams)
+    ]
+    heapify(heap)
+    while heap:
+        key, n, group, pages, pending = heappop(heap)
+        if pending:
+            buffer, i = pending.popleft()
+            yield group, buffer, i
+        else:
+            buffer = next(pages, None)
+            if buffer is None:
+                continue
+            pending.extend(_search_page(buffer, config))
+        if pending:
+            next_buffer, next_i = pending[0]
+            key = -next_buffer[next_i]["created_at"]
+        elif buffer:
+            key = -buffer[-1]["created_at"]
+        heappush(heap, (key, n, group, pages, pending))
+
+
 def search_all(args):
     "the real main method. given some config, search for all matching messages"
+    groups = get_all_matching_groups(args)
+    if args.merge:
+        # fetch serially, so only about one page per group is kept in memory
+        streams = (
+            ((name, group, dm), get_pages(group, dm=dm)) for name, group, dm in groups
+        )
+        last = None
+        for key, buffer, i in islice(merge_searches(streams, args), args.max_count):
+            # compare on the id, since different groups can have the same name
+            if key != last and not args.json:
+                print_group(key[0], color=args.color)
+            last = key
+            print_message(buffer, i, args)
+        return
+
     # search groups and dms
-    for dm in [True, False]:
-        for name, group in get_group(args.groups, dm=dm):
-            if not args.json:
-                print_group(name, color=args.color)
-            for buffer, i in search_messages(group, args, dm=dm):
-                print_message(buffer, i, args)
+    count = 0
+    for name, group, dm in groups:
+        if count == args.max_count:
+            return
+        if not args.json:
+            print_group(name, color=args.color)
+        search = search_messages(group, args, dm=dm)
+        if args.max_count is not None:
+            search = islice(search, args.max_count - count)
+        for buffer, i in search:
+            print_message(buffer, i, args)
+            count += 1
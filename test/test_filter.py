@@ -57,3 +57,42 @@ def test_user(text):
 def test_illegal_arguments():
     with pytest.raises(SystemExit):
         config("-f", "-F")
+
+
+message_fields = strategies.lists(
+    strategies.tuples(
+        strategies.none() | strategies.text(), strategies.text(), strategies.booleans()
+    )
+)
+
+
+@given(message_fields, strategies.text())
+@example([("a\nb", "a", False), ("", "b", True), ("b", "ab", False)], "^b")
+@example([("-0", "a", True), (None, "a", False)], "-0")
+def test_filter_page(messages, regex):
+    try:
+        re.compile(regex)
+    except re.error:
+        return
+    buffer = [
+        {
+            "text": text,
+            "name": name,
+            "favorited_by": [grepme.get_logged_in_user()] if liked else [],
+        }
+        for text, name, liked in messages
+    ]
+    for args in [(), ("-v",), ("-o",), ("-i",), ("-u", "a"), ("-f",), ("-F",)]:
+        # "--" so that patterns starting with "-" aren't parsed as options
+        conf = config(*(args + ("--", regex)))
+        expected = [
+            (i, result)
+            for i, result in (
+                (i, grepme.filter_message(message, conf))
+                for i, message in enumerate(buffer)
+            )
+            if result is not None
+        ]
+        actual = grepme.filter_page(buffer, conf)
+        assert [i for i, _ in actual] == [i for i, _ in expected]
+        assert [m.span() for _, m in actual] == [m.span() for _, m in expected]
@@ -0,0 +1,44 @@
+from itertools import islice
+
+from hypothesis import given, strategies
+
+import grepme
+
+
+def config(*args):
+    return grepme.make_config(grepme.make_parser().parse_args(args=args))
+
+
+def fake_pages(messages, fetched, limit=10):
+    "yield pages like get_pages, newest first, counting how many were fetched"
+    messages = sorted(messages, key=lambda m: m["created_at"], reverse=True)
+    for start in range(0, len(messages), limit):
+        fetched.append(start)
+        yield messages[start : start + limit]
+
+
+def fake_messages(times, text="match"):
+    return [{"text": text, "created_at": t} for t in times]
+
+
+@given(strategies.lists(strategies.lists(strategies.integers())))
+def test_merge_is_sorted(groups):
+    streams = [
+        (n, fake_pages(fake_messages(times), [])) for n, times in enumerate(groups)
+    ]
+    merged = grepme.merge_searches(streams, config("--no-color", "match"))
+    times = [buffer[i]["created_at"] for _, buffer, i in merged]
+    assert times == sorted(sum(groups, []), reverse=True)
+
+
+def test_merge_is_lazy():
+    never, always = [], []
+    streams = [
+        ("never", fake_pages(fake_messages(range(1, 2000, 2), "nope"), never)),
+        ("always", fake_pages(fake_messages(range(0, 2000, 2)), always)),
+    ]
+    merged = grepme.merge_searches(streams, config("--no-color", "match"))
+    results = list(islice(merged, 10))
+    assert [group for group, _, _ in results] == ["always"] * 10
+    assert len(never) <= 2
+    assert len(always) == 1
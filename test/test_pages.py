@@ -0,0 +1,95 @@
+import pytest
+
+import grepme.lib
+
+
+class FakeCache(dict):
+    def set(self, key, value):
+        self[key] = set(value)
+
+
+def new_messages(messages, count):
+    "add `count` messages newer than any in `messages`"
+    newest = int(messages[0]["id"]) if messages else 0
+    messages[:0] = [
+        {"id": str(n), "created_at": n} for n in range(newest + count, newest, -1)
+    ]
+
+
+def fake_group(count, fetched, limit=10):
+    "return a get_messages replacement for a group with `count` messages"
+    messages = []
+    new_messages(messages, count)
+
+    def get_function(group, before_id=None):
+        fetched.append(before_id)
+        if before_id is None:
+            return messages[:limit]
+        older = [m for m in messages if int(m["id"]) < int(before_id)]
+        return older[:limit]
+
+    return messages, get_function
+
+
+@pytest.fixture
+def group(monkeypatch):
+    "a group with 500 messages and checkpoints every 3 pages"
+    fetched = []
+    messages, get_function = fake_group(500, fetched)
+    monkeypatch.setattr(grepme.lib, "CHECKPOINTS", FakeCache())
+    monkeypatch.setattr(grepme.lib, "CHECKPOINT_INTERVAL", 3)
+    monkeypatch.setattr(grepme.lib, "get_messages", get_function)
+    return messages, fetched
+
+
+def test_parallel_pages_are_in_order(group):
+    messages, _ = group
+
+    # the first run is serial and leaves checkpoints behind
+    first = [m for page in grepme.lib.get_pages("group", jobs=4) for m in page]
+    assert first == messages
+    assert grepme.lib.CHECKPOINTS[(False, "group")]
+
+    # the second run is split at the checkpoints
+    second = [m for page in grepme.lib.get_pages("group", jobs=4) for m in page]
+    assert second == messages
+
+
+def test_parallel_pages_are_lazy(group):
+    _, fetched = group
+    list(grepme.lib.get_pages("group", jobs=4))
+
+    del fetched[:]
+    pages = grepme.lib.get_pages("group", jobs=4)
+    next(pages)
+    pages.close()
+    assert fetched == [None]
+
+
+def test_parallel_pages_exit(group, monkeypatch):
+    list(grepme.lib.get_pages("group", jobs=4))
+    get_function = grepme.lib.get_messages
+
+    def unauthorized(group, before_id=None):
+        "like http._get on a 401, partway through the history"
+        if before_id is not None and int(before_id) < 100:
+            raise SystemExit("Permission denied")
+        return get_function(group, before_id)
+
+    monkeypatch.setattr(grepme.lib, "get_messages", unauthorized)
+    with pytest.raises(SystemExit):
+        list(grepme.lib.get_pages("group", jobs=4))
+
+
+@pytest.mark.parametrize("jobs", [[1] * 6, [4] * 6, [1, 4, 1, 1, 4, 4]])
+def test_checkpoints_stay_sparse(group, jobs):
+    messages, _ = group
+    for n in jobs:
+        pages = list(grepme.lib.get_pages("group", jobs=n))
+        assert [m for page in pages for m in page] == messages
+
+        checkpoints = grepme.lib.CHECKPOINTS[(False, "group")]
+        # 10 messages a page
+        expected = len(messages) // 10 // grepme.lib.CHECKPOINT_INTERVAL
+        assert expected - 2 <= len(checkpoints) <= expected
+        new_messages(messages, 7)